@@ -34,7 +34,7 @@ def get_hash(filename):
         return None # Or another default value
     return hash_md5.hexdigest()
 
-def find_files(folder, exclude=None):
+def find_files(folder, exclude=None, hasher=get_hash):
     """Recursively finds all files in a directory and calculates their hashes.
 
     Ignores files/directories whose path contains the `exclude` string.
@@ -44,6 +44,8 @@ def find_files(folder, exclude=None):
         folder (str): The root directory to search.
         exclude (str, optional): A string (or regex pattern), paths containing it will be excluded.
                                  Defaults to None (nothing excluded).
+        hasher (callable, optional): Function mapping a file path to its MD5 hash
+                                     (or None). Defaults to get_hash.
 
     Yields:
         tuple: A tuple (relative_path, md5_hash) for each found file.
@@ -65,12 +67,12 @@ def find_files(folder, exclude=None):
             if exclude and exclude in filename: # Check the full path for exclude
                 continue # Skip the file if it matches the exclusion pattern
 
-            file_hash = get_hash(filename)
+            file_hash = hasher(filename)
             if file_hash: # Ensure the hash was obtained (file wasn't deleted)
                 yield relative_path, file_hash
 
 
-def GetState(folder, exclude=None):
+def GetState(folder, exclude=None, hasher=get_hash):
     """Creates a dictionary representing the state of a directory (file -> hash).
 
     Uses find_files to get the list of files and their hashes.
@@ -78,12 +80,13 @@ def GetState(folder, exclude=None):
     Args:
         folder (str): Path to the directory.
         exclude (str, optional): Pattern to exclude files/directories.
+        hasher (callable, optional): Function used to hash each file. Defaults to get_hash.
 
     Returns:
         dict: A dictionary where keys are relative file paths (with '/' separator),
               and values are their MD5 hashes.
     """
-    return dict(find_files(folder, exclude))
+    return dict(find_files(folder, exclude, hasher))
 
 
 def GetStateHash(state):
@@ -233,7 +236,7 @@ def CheckGitRepo(target):
         raise Exception(f"Error running git fsck in {target}: {e}")
 
 
-def ApplyPatch(target, patch_file, exclude=None):
+def ApplyPatch(target, patch_file, exclude=None, hasher=get_hash):
     """Applies a patch to the target directory.
 
     Verifies that the current state of the target directory matches
@@ -245,6 +248,9 @@ def ApplyPatch(target, patch_file, exclude=None):
         patch_file (str): Path to the ZIP patch file.
         exclude (str, optional): Pattern to exclude files when checking the
                                  current state of the target directory.
+        hasher (callable, optional): Function used to hash files when computing
+                                     the state of the target directory. Extracted
+                                     files are always verified with get_hash.
 
     Returns:
         bool: True if the patch was successfully applied or if the directory
@@ -277,7 +283,7 @@ def ApplyPatch(target, patch_file, exclude=None):
         print(f"Patch contains: Removed: {len(diff.get('removed',[]))}, Added: {len(diff.get('added',[]))}, Changed: {len(diff.get('changed',[]))}")
 
         # Get the current state of the target directory
-        current_state = GetState(target, exclude)
+        current_state = GetState(target, exclude, hasher)
         state_hash = GetStateHash(current_state)
 
         print(f"Current state hash: {state_hash}")
@@ -364,7 +370,7 @@ def ApplyPatch(target, patch_file, exclude=None):
 
         print("Patch applied successfully.")
         # Optional final check: hash of the state after patching should match target_state
-        final_state_hash = GetStateHash(GetState(target, exclude))
+        final_state_hash = GetStateHash(GetState(target, exclude, hasher))
         if final_state_hash != diff.get('target_state'):
              print(f"Warning: Final state hash ({final_state_hash}) does not match patch target state hash ({diff.get('target_state')}). This might indicate issues during patching or with excluded files.")
 
@@ -1,2 +1,101 @@
-def main():
-    print("It's alive!")
\ No newline at end of file
+import argparse
+import json
+import os
+import sys
+
+from stateman.daemon import SOCKET_ENV, REQUEST_TIMEOUT, Workspace, Serve, Request
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="stateman",
+        description="Track directory states and create/apply binary patches.")
+    parser.add_argument("--socket", default=os.environ.get(SOCKET_ENV),
+                        help=f"Send commands to a running daemon on this Unix socket "
+                             f"(default: ${SOCKET_ENV}; runs in-process if unset).")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT,
+                        help=f"Seconds to wait for a daemon response (default: {REQUEST_TIMEOUT}).")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    state = commands.add_parser("state", help="Print the state of a folder as JSON.")
+    state.add_argument("folder")
+    state.add_argument("--hash", dest="hash_only", action="store_true",
+                       help="Print only the state hash.")
+
+    diff = commands.add_parser("diff", help="Print the difference between two states as JSON.")
+    diff.add_argument("old", help="Folder or state JSON file (output of `stateman state`).")
+    diff.add_argument("new", help="Folder or state JSON file.")
+
+    create = commands.add_parser("create", help="Create a patch from OLD to the NEW folder.")
+    create.add_argument("old", help="Folder or state JSON file with the source state.")
+    create.add_argument("new", help="Folder with the target state (files are taken from it).")
+    create.add_argument("patch_file")
+
+    apply = commands.add_parser("apply", help="Apply a patch to a folder.")
+    apply.add_argument("target")
+    apply.add_argument("patch_file")
+
+    verify = commands.add_parser("verify", help="Check a folder against a state hash or a patch.")
+    verify.add_argument("folder")
+    verify.add_argument("--hash", dest="state_hash", help="Expected state hash.")
+    verify.add_argument("--patch", dest="patch_file",
+                        help="Patch the folder must be in the source or target state of.")
+
+    for sub in (state, diff, create, apply, verify):
+        sub.add_argument("--exclude", help="Exclude paths containing this string.")
+
+    daemon = commands.add_parser("daemon", help="Serve commands on a Unix socket with warm caches.")
+    daemon.add_argument("--stop", action="store_true", help="Stop the daemon listening on the socket.")
+    return parser
+
+
+# Arguments holding paths; they are made absolute before being sent to a daemon
+PATH_ARGS = ("folder", "old", "new", "target", "patch_file")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == "daemon":
+        if not args.socket:
+            print(f"Error: daemon needs --socket or ${SOCKET_ENV}.", file=sys.stderr)
+            return 2
+        try:
+            if args.stop:
+                Request(args.socket, "shutdown", timeout=args.timeout)
+            else:
+                Serve(args.socket, ready=lambda: print(f"stateman daemon listening on {args.socket}", flush=True))
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        return 0
+
+    command_args = {k: v for k, v in vars(args).items() if k not in ("command", "socket", "timeout")}
+    for key in PATH_ARGS:
+        if command_args.get(key):
+            command_args[key] = os.path.abspath(command_args[key])
+    if args.command == "verify" and not (args.state_hash or args.patch_file):
+        print("Error: verify needs --hash or --patch.", file=sys.stderr)
+        return 2
+
+    try:
+        if args.socket:
+            result, output = Request(args.socket, args.command, timeout=args.timeout, **command_args)
+            sys.stdout.write(output)
+        else:
+            result = Workspace().run(args.command, **command_args)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    if isinstance(result, str):
+        print(result)
+    else:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.command == "verify" and not result['ok']:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
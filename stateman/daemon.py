@@ -0,0 +1,378 @@
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+from collections import OrderedDict
+from zipfile import ZipFile
+
+from stateman import GetState, GetStateHash, GetDiff, CreatePatch, ApplyPatch, get_hash
+
+# Environment variable with the default daemon socket path for CLI commands
+SOCKET_ENV = "STATEMAN_SOCKET"
+# Default seconds a client waits for a daemon response (jobs may rescan large folders)
+REQUEST_TIMEOUT = 600
+# Seconds to wait for a liveness ping
+PING_TIMEOUT = 5
+
+
+class DaemonError(Exception):
+    """An error raised by a command executed inside the daemon."""
+
+
+class HashCache:
+    """Remembers file hashes and reuses them while a file's stat is unchanged.
+
+    A file is rehashed only when its size, modification time or inode differs
+    from the values seen when it was last hashed. Changes that keep all three
+    intact (e.g. an in-place rewrite that restores the mtime) are not detected.
+
+    The cache stays bounded in a long-running daemon: `prune` drops entries for
+    files under a folder that a scan no longer saw (deleted or excluded), and
+    once `max_entries` is exceeded the least recently used entries are evicted,
+    so folders that are never scanned again eventually leave memory. Entries are
+    indexed by directory, so pruning a folder only touches what is cached
+    beneath it.
+
+    Args:
+        max_entries (int, optional): Maximum number of cached file hashes.
+    """
+
+    def __init__(self, max_entries=1000000):
+        self.max_entries = max_entries
+        self._hashes = OrderedDict() # path -> (size, mtime_ns, inode, md5), least recently used first
+        self._files = {} # directory -> cached paths directly inside it
+        self._subdirs = {} # directory -> child directories with cached paths beneath them
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def hash(self, filename):
+        """Drop-in replacement for get_hash that consults the cache first."""
+        try:
+            file_stat = os.stat(filename)
+        except FileNotFoundError:
+            self._discard(filename)
+            return get_hash(filename) # Keeps the warning/None behavior of get_hash
+        key = (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+        cached = self._hashes.get(filename)
+        if cached and cached[:3] == key:
+            self._hashes.move_to_end(filename)
+            return cached[3]
+        file_hash = get_hash(filename)
+        if file_hash:
+            if not cached:
+                self._link(filename)
+            self._hashes[filename] = key + (file_hash,)
+            self._hashes.move_to_end(filename)
+            while len(self._hashes) > self.max_entries:
+                self._discard(next(iter(self._hashes)))
+        return file_hash
+
+    def prune(self, folder, seen):
+        """Drops cached entries under `folder` whose paths are not in `seen`.
+
+        Args:
+            folder (str): Folder that was just scanned.
+            seen (set): Paths hashed during that scan.
+        """
+        stale = []
+        pending = [os.path.normpath(folder)]
+        while pending:
+            directory = pending.pop()
+            stale.extend(f for f in self._files.get(directory, ()) if f not in seen)
+            pending.extend(self._subdirs.get(directory, ()))
+        for filename in stale:
+            self._discard(filename)
+
+    def clear(self):
+        self._hashes.clear()
+        self._files.clear()
+        self._subdirs.clear()
+
+    def _link(self, filename):
+        """Adds a path to the directory index."""
+        directory = os.path.dirname(filename)
+        self._files.setdefault(directory, set()).add(filename)
+        # Register the directory with its ancestors until one already knows it
+        while True:
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+            children = self._subdirs.setdefault(parent, set())
+            if directory in children:
+                break
+            children.add(directory)
+            directory = parent
+
+    def _discard(self, filename):
+        """Removes a path from the cache and the directory index."""
+        if self._hashes.pop(filename, None) is None:
+            return
+        directory = os.path.dirname(filename)
+        self._files[directory].discard(filename)
+        # Drop directories that no longer hold anything cached
+        while not self._files.get(directory) and not self._subdirs.get(directory):
+            self._files.pop(directory, None)
+            self._subdirs.pop(directory, None)
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+            self._subdirs[parent].discard(directory)
+            directory = parent
+
+
+class Workspace:
+    """Implements the CLI commands on top of warm per-process caches.
+
+    A single Workspace is kept alive by the daemon, so file hashes and patch
+    metadata survive between requests. The CLI without a daemon uses a fresh
+    Workspace per run, which behaves exactly like the plain library calls.
+
+    All paths passed to the commands must be absolute when they are sent to a
+    daemon, since the daemon may run in a different working directory.
+
+    Args:
+        max_patches (int, optional): Maximum number of patches whose state
+                                     hashes are kept (least recently used are evicted).
+    """
+
+    def __init__(self, max_patches=1024):
+        self.hashes = HashCache()
+        self.max_patches = max_patches
+        # patch path -> ((size, mtime_ns), {'source_state', 'target_state'}), least recently used first
+        self._patches = OrderedDict()
+
+    def run(self, command, **args):
+        """Dispatches a command by name and returns its JSON-serializable result."""
+        handler = getattr(self, f"cmd_{command}", None)
+        if handler is None:
+            raise ValueError(f"Unknown command: {command}")
+        return handler(**args)
+
+    # --- Helpers ---
+
+    def get_state(self, folder, exclude=None):
+        """GetState using the warm hash cache (and pruning it for this folder)."""
+        if not os.path.isdir(folder):
+            raise FileNotFoundError(f"Directory not found: {folder}")
+        seen = set()
+
+        def hasher(filename):
+            seen.add(filename)
+            return self.hashes.hash(filename)
+
+        state = GetState(folder, exclude, hasher)
+        self.hashes.prune(folder, seen)
+        return state
+
+    def load_state(self, path, exclude=None):
+        """Returns a state for a folder, or reads one saved with `stateman state`."""
+        if os.path.isdir(path):
+            return self.get_state(path, exclude)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Folder or state file not found: {path}")
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def read_patch_states(self, patch_file):
+        """Returns the source and target state hashes of a patch.
+
+        Only the two hashes are cached (not the full metadata), until the patch file changes.
+        """
+        if not os.path.isfile(patch_file):
+            raise FileNotFoundError(f"Patch file not found: {patch_file}")
+        patch_stat = os.stat(patch_file)
+        key = (patch_stat.st_size, patch_stat.st_mtime_ns)
+        cached = self._patches.get(patch_file)
+        if cached and cached[0] == key:
+            self._patches.move_to_end(patch_file)
+            return cached[1]
+        with ZipFile(patch_file, "r") as patch:
+            try:
+                metadata = json.loads(patch.read("metadata.json").decode("utf-8"))
+            except KeyError:
+                raise ValueError("Invalid patch file: metadata.json not found.")
+            except json.JSONDecodeError:
+                raise ValueError("Invalid patch file: metadata.json is corrupted.")
+        states = {'source_state': metadata.get('source_state'), 'target_state': metadata.get('target_state')}
+        self._patches[patch_file] = (key, states)
+        self._patches.move_to_end(patch_file)
+        while len(self._patches) > self.max_patches:
+            self._patches.popitem(last=False)
+        return states
+
+    # --- Commands ---
+
+    def cmd_state(self, folder, exclude=None, hash_only=False):
+        state = self.get_state(folder, exclude)
+        return GetStateHash(state) if hash_only else state
+
+    def cmd_diff(self, old, new, exclude=None):
+        return GetDiff(self.load_state(old, exclude), self.load_state(new, exclude))
+
+    def cmd_create(self, old, new, patch_file, exclude=None):
+        diff = GetDiff(self.load_state(old, exclude), self.get_state(new, exclude))
+        CreatePatch(new, patch_file, diff)
+        return {
+            'patch_file': patch_file,
+            'source_state': diff['source_state'],
+            'target_state': diff['target_state'],
+            'removed': len(diff['removed']),
+            'added': len(diff['added']),
+            'changed': len(diff['changed']),
+        }
+
+    def cmd_apply(self, target, patch_file, exclude=None):
+        ApplyPatch(target, patch_file, exclude, self.hashes.hash)
+        return {'target_state': GetStateHash(self.get_state(target, exclude))}
+
+    def cmd_verify(self, folder, state_hash=None, patch_file=None, exclude=None):
+        current = GetStateHash(self.get_state(folder, exclude))
+        result = {'state': current}
+        if state_hash is not None:
+            result['ok'] = current == state_hash
+        if patch_file is not None:
+            result.update(self.read_patch_states(patch_file))
+            # A folder is fine for a patch if the patch can be applied or was already applied
+            result['ok'] = result.get('ok', True) and current in (result['source_state'], result['target_state'])
+        if 'ok' not in result:
+            raise ValueError("verify needs a state hash or a patch file to compare with.")
+        return result
+
+    def cmd_ping(self):
+        return {'pid': os.getpid(), 'cached_hashes': len(self.hashes), 'cached_patches': len(self._patches)}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Handles one JSON request line {"command": ..., "args": {...}} and closes the connection."""
+
+    # Seconds a client may take to send its request before the connection is dropped
+    timeout = 30
+
+    def handle(self):
+        try:
+            line = self.rfile.readline()
+        except OSError: # Includes the read timeout of a stalled client
+            return
+        if not line.strip():
+            return
+        output = io.StringIO()
+        try:
+            request = json.loads(line.decode("utf-8"))
+            command = request.get('command')
+            if command == "shutdown":
+                result = None
+                self.server.shutdown_requested = True
+            elif command == "ping":
+                # Answered without waiting for a running job, so liveness checks stay fast
+                result = self.server.workspace.cmd_ping()
+            else:
+                # Jobs run one at a time: the caches are shared and stdout is redirected globally
+                with self.server.lock, contextlib.redirect_stdout(output):
+                    result = self.server.workspace.run(command, **request.get('args', {}))
+            response = {'ok': True, 'result': result, 'output': output.getvalue()}
+        except Exception as e:
+            response = {'ok': False, 'error': str(e), 'type': type(e).__name__, 'output': output.getvalue()}
+        try:
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+        except OSError:
+            pass # The client went away; nothing left to report to
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves every connection in its own thread, so a stalled client blocks nobody."""
+
+    # How often (seconds) the serving loop checks whether shutdown was requested
+    timeout = 0.5
+
+
+def Serve(socket_path, workspace=None, ready=None):
+    """Runs the daemon on a Unix socket until a "shutdown" request arrives.
+
+    Each connection is handled in its own thread and carries a single request.
+    Commands that touch the shared caches are serialized by a lock.
+
+    Args:
+        socket_path (str): Path of the Unix socket to listen on.
+        workspace (Workspace, optional): Workspace holding the warm caches.
+        ready (callable, optional): Called without arguments once the socket is bound.
+
+    Raises:
+        OSError: If Unix sockets are not supported, the socket is in use,
+                 or something other than a socket exists at `socket_path`.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise OSError("The stateman daemon requires Unix domain socket support.")
+    if os.path.lexists(socket_path):
+        # Never remove anything that is not a socket (e.g. a mistyped --socket path)
+        if not _is_socket(socket_path):
+            raise OSError(f"{socket_path} exists and is not a socket")
+        # Refuse to take over a socket that still has a live daemon behind it
+        try:
+            Request(socket_path, "ping", timeout=PING_TIMEOUT)
+        except TimeoutError:
+            raise OSError(f"A stateman daemon on {socket_path} accepts connections but does not respond")
+        except OSError:
+            os.remove(socket_path) # Stale socket left by a crashed daemon
+        else:
+            raise OSError(f"A stateman daemon is already listening on {socket_path}")
+
+    server = _DaemonServer(socket_path, _RequestHandler)
+    server.workspace = workspace or Workspace()
+    server.lock = threading.Lock()
+    server.shutdown_requested = False
+    try:
+        if ready:
+            ready()
+        while not server.shutdown_requested:
+            server.handle_request()
+    finally:
+        server.server_close() # Waits for running jobs to finish
+        if _is_socket(socket_path):
+            os.remove(socket_path)
+
+
+def _is_socket(path):
+    """Checks whether `path` exists and is a Unix socket (symlinks are not followed)."""
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def Request(socket_path, command, timeout=REQUEST_TIMEOUT, **args):
+    """Sends one command to a running daemon and returns its response.
+
+    Args:
+        socket_path (str): Path of the daemon's Unix socket.
+        command (str): Command name (state, diff, create, apply, verify, ping, shutdown).
+        timeout (float, optional): Seconds to wait for the connection and the response.
+        **args: Command arguments; paths must be absolute.
+
+    Returns:
+        tuple: (result, output) where output is the text the command printed.
+
+    Raises:
+        OSError: If the daemon cannot be reached.
+        TimeoutError: If the daemon does not respond within `timeout`.
+        DaemonError: If the command failed inside the daemon.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        try:
+            client.connect(socket_path)
+            client.sendall(json.dumps({'command': command, 'args': args}).encode("utf-8") + b"\n")
+            with client.makefile("rb") as reader:
+                line = reader.readline()
+        except TimeoutError:
+            raise TimeoutError(f"No response from stateman daemon at {socket_path} within {timeout} seconds")
+    if not line:
+        raise OSError(f"No response from stateman daemon at {socket_path}")
+    response = json.loads(line.decode("utf-8"))
+    if not response.get('ok'):
+        raise DaemonError(f"{response.get('type', 'Error')}: {response.get('error')}")
+    return response.get('result'), response.get('output', "")
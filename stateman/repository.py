@@ -0,0 +1,287 @@
+import json
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from collections import OrderedDict
+from zipfile import ZipFile
+
+from stateman import GetState, GetStateHash, GetDiff, ClearPatch, get_hash
+
+# Binary manifest layout (before zlib compression):
+#   header: magic (4 bytes) + format version (1 byte) + entry count (uint32)
+#   entry:  MD5 digest (16 bytes) + path length (uint16) + UTF-8 path
+MANIFEST_MAGIC = b"SMAN"
+MANIFEST_VERSION = 1
+_HEADER = struct.Struct("<4sBI")
+_ENTRY = struct.Struct("<16sH")
+# Suffix of temporary files written before an atomic rename into place
+TMP_SUFFIX = ".tmp"
+
+
+def PackManifest(state):
+    """Serializes a directory state into a compressed binary manifest.
+
+    Entries are sorted by path, so the same state always produces the same bytes.
+
+    Args:
+        state (dict): The directory state dictionary (result of GetState).
+
+    Returns:
+        bytes: The zlib-compressed manifest.
+    """
+    chunks = [_HEADER.pack(MANIFEST_MAGIC, MANIFEST_VERSION, len(state))]
+    for path, file_hash in sorted(state.items()):
+        encoded = path.encode('utf-8')
+        chunks.append(_ENTRY.pack(bytes.fromhex(file_hash), len(encoded)))
+        chunks.append(encoded)
+    return zlib.compress(b"".join(chunks))
+
+
+def UnpackManifest(data):
+    """Restores a directory state from a compressed binary manifest.
+
+    Args:
+        data (bytes): Manifest produced by PackManifest.
+
+    Returns:
+        dict: The directory state dictionary (relative path -> MD5 hash).
+
+    Raises:
+        ValueError: If the data is not a valid manifest.
+    """
+    try:
+        raw = zlib.decompress(data)
+        magic, version, count = _HEADER.unpack_from(raw, 0)
+    except (zlib.error, struct.error):
+        raise ValueError("Invalid manifest: data is corrupted.")
+    if magic != MANIFEST_MAGIC:
+        raise ValueError("Invalid manifest: bad magic header.")
+    if version != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version: {version}")
+
+    state = {}
+    offset = _HEADER.size
+    try:
+        for _ in range(count):
+            digest, length = _ENTRY.unpack_from(raw, offset)
+            offset += _ENTRY.size
+            path = raw[offset:offset + length].decode('utf-8')
+            offset += length
+            state[path] = digest.hex()
+    except (struct.error, UnicodeDecodeError):
+        raise ValueError("Invalid manifest: data is truncated.")
+    return state
+
+
+class SnapshotRepository:
+    """Stores directory snapshots and serves patches between any two of them.
+
+    The repository keeps everything under a single root directory:
+      - manifests/<state_hash>  compressed binary manifests (see PackManifest);
+      - objects/<xx>/<md5>      file contents, stored once per unique MD5;
+      - patches/<from>_<to>.patch  cached patches in the CreatePatch format.
+
+    Snapshots are keyed by GetStateHash, so adding the same folder state twice
+    is a no-op. Patches are built from the content store on first request and
+    then reused; the cache is trimmed in least-recently-used order once it
+    exceeds either `max_cache_bytes` or `max_cache_entries`.
+
+    Args:
+        root (str): Repository directory (created if it does not exist).
+        max_cache_bytes (int, optional): Total size budget for cached patches.
+        max_cache_entries (int, optional): Maximum number of cached patches.
+    """
+
+    def __init__(self, root, max_cache_bytes=512 * 1024 * 1024, max_cache_entries=64):
+        self.root = os.path.abspath(root)
+        self.max_cache_bytes = max_cache_bytes
+        self.max_cache_entries = max_cache_entries
+        self.manifests_dir = os.path.join(self.root, "manifests")
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.patches_dir = os.path.join(self.root, "patches")
+        for folder in (self.manifests_dir, self.objects_dir, self.patches_dir):
+            os.makedirs(folder, exist_ok=True)
+            # Remove temporary files left by a process that died mid-write
+            # (blob temp files live directly in objects/, see _store_blob)
+            for name in os.listdir(folder):
+                if name.endswith(TMP_SUFFIX):
+                    os.remove(os.path.join(folder, name))
+
+        # patch filename -> size; order is least to most recently used
+        self._patch_cache = OrderedDict()
+        # Restore the LRU order of patches left over from previous runs (by mtime)
+        entries = []
+        for name in os.listdir(self.patches_dir):
+            path = os.path.join(self.patches_dir, name)
+            if name.endswith(".patch") and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._patch_cache[name] = size
+        self._trim_cache()
+
+    # --- Snapshots ---
+
+    def AddSnapshot(self, folder, exclude=None):
+        """Captures the state of a folder and stores it in the repository.
+
+        Only files whose contents are not yet in the content store are copied.
+
+        Args:
+            folder (str): Path to the directory.
+            exclude (str, optional): Pattern to exclude files/directories.
+
+        Returns:
+            str: The state hash under which the snapshot is stored.
+        """
+        state = GetState(folder, exclude)
+        for relative_path, file_hash in state.items():
+            self._store_blob(os.path.join(folder, ClearPatch(relative_path)), file_hash)
+
+        state_hash = GetStateHash(state)
+        manifest_path = self._manifest_path(state_hash)
+        if not os.path.isfile(manifest_path):
+            self._write_atomic(manifest_path, PackManifest(state))
+        return state_hash
+
+    def GetSnapshot(self, state_hash):
+        """Returns the stored state for a state hash.
+
+        Args:
+            state_hash (str): Hash of a stored snapshot.
+
+        Returns:
+            dict: The directory state dictionary.
+
+        Raises:
+            KeyError: If no snapshot with this hash is stored.
+        """
+        manifest_path = self._manifest_path(state_hash)
+        if not os.path.isfile(manifest_path):
+            raise KeyError(f"Snapshot not found: {state_hash}")
+        with open(manifest_path, "rb") as f:
+            return UnpackManifest(f.read())
+
+    def HasSnapshot(self, state_hash):
+        """Checks whether a snapshot with the given hash is stored."""
+        return os.path.isfile(self._manifest_path(state_hash))
+
+    def ListSnapshots(self):
+        """Returns the sorted list of stored state hashes."""
+        return sorted(name for name in os.listdir(self.manifests_dir) if not name.endswith(TMP_SUFFIX))
+
+    def GetBlobPath(self, file_hash):
+        """Returns the content store path for a file hash (the file may not exist)."""
+        return os.path.join(self.objects_dir, file_hash[:2], file_hash)
+
+    # --- Patches ---
+
+    def GetPatch(self, source_hash, target_hash):
+        """Returns a patch that turns one stored snapshot into another.
+
+        The patch is built from the content store on the first request for the
+        pair and served from the cache afterwards. The result has the same
+        format as CreatePatch output and can be passed to ApplyPatch.
+
+        Args:
+            source_hash (str): State hash the patch is applied to.
+            target_hash (str): State hash the patch produces.
+
+        Returns:
+            str: Path to the patch file inside the repository cache. The file
+                 may be evicted by later GetPatch calls, so copy it if it has
+                 to outlive them.
+
+        Raises:
+            KeyError: If either snapshot is not stored.
+        """
+        name = f"{source_hash}_{target_hash}.patch"
+        patch_path = os.path.join(self.patches_dir, name)
+
+        if name in self._patch_cache and os.path.isfile(patch_path):
+            # Cache hit: mark as most recently used (mtime keeps the order across restarts)
+            self._patch_cache.move_to_end(name)
+            os.utime(patch_path)
+            return patch_path
+
+        diff = GetDiff(self.GetSnapshot(source_hash), self.GetSnapshot(target_hash))
+        fd, tmp_path = tempfile.mkstemp(dir=self.patches_dir, suffix=TMP_SUFFIX)
+        os.close(fd)
+        try:
+            self._build_patch(tmp_path, diff)
+            os.replace(tmp_path, patch_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._patch_cache[name] = os.path.getsize(patch_path)
+        self._patch_cache.move_to_end(name)
+        self._trim_cache(keep=name)
+        return patch_path
+
+    def CachedPatches(self):
+        """Returns cached (source_hash, target_hash) pairs, least recently used first."""
+        return [tuple(name[:-len(".patch")].split("_", 1)) for name in self._patch_cache]
+
+    # --- Internal helpers ---
+
+    def _manifest_path(self, state_hash):
+        return os.path.join(self.manifests_dir, state_hash)
+
+    def _store_blob(self, source_path, file_hash):
+        """Copies a file into the content store unless its hash is already there."""
+        blob_path = self.GetBlobPath(file_hash)
+        if os.path.isfile(blob_path):
+            return
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        # The temp file goes to the top of objects/ so stale ones are found without a full walk
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects_dir, suffix=TMP_SUFFIX)
+        os.close(fd)
+        try:
+            shutil.copyfile(source_path, tmp_path)
+            # The file may have changed since it was hashed; never store a blob under a wrong key
+            if get_hash(tmp_path) != file_hash:
+                raise ValueError(f"File changed while creating snapshot: {source_path}")
+            os.replace(tmp_path, blob_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _build_patch(self, patch_file, diff):
+        """Writes a patch for `diff`, taking file contents from the content store."""
+        with ZipFile(patch_file, "w") as z:
+            z.writestr("metadata.json", data=json.dumps(diff, indent=4, ensure_ascii=False))
+            for file in diff.get('added', []) + diff.get('changed', []):
+                z.write(self.GetBlobPath(diff['md5'][file]), arcname=file)
+
+    def _write_atomic(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=TMP_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _trim_cache(self, keep=None):
+        """Evicts least recently used patches until the cache fits its budget.
+
+        The entry named `keep` (the patch just returned) is never evicted, even
+        if it alone exceeds the size budget.
+        """
+        total = sum(self._patch_cache.values())
+        for name in list(self._patch_cache):
+            if total <= self.max_cache_bytes and len(self._patch_cache) <= self.max_cache_entries:
+                break
+            if name == keep:
+                continue
+            total -= self._patch_cache.pop(name)
+            try:
+                os.remove(os.path.join(self.patches_dir, name))
+            except FileNotFoundError:
+                pass
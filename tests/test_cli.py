@@ -0,0 +1,217 @@
+import pytest
+from stateman import GetState, GetStateHash
+from stateman.__main__ import main
+from stateman.daemon import Workspace, Serve, Request, DaemonError
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+
+# --- Helper Functions ---
+
+def write_file(filepath, text):
+    """Вспомогательная функция для создания файла с текстом."""
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    with open(filepath, 'w') as f:
+        f.write(text)
+
+def run_cli(capsys, *argv):
+    """Запускает CLI и возвращает (код возврата, stdout)."""
+    code = main([str(arg) for arg in argv])
+    return code, capsys.readouterr().out
+
+@pytest.fixture
+def daemon_socket(tmp_path):
+    """Запускает демон в отдельном потоке и останавливает его после теста."""
+    if not hasattr(socket, "AF_UNIX"):
+        pytest.skip("Unix sockets are not supported")
+    socket_path = str(tmp_path / "stateman.sock")
+    workspace = Workspace()
+    thread = threading.Thread(target=Serve, args=(socket_path, workspace), daemon=True)
+    thread.start()
+    for _ in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.01)
+    yield socket_path, workspace
+    Request(socket_path, "shutdown")
+    thread.join(timeout=5)
+    assert not os.path.exists(socket_path)
+
+# --- Test Cases ---
+
+def test_cli_state_create_apply_verify(tmp_path, capsys):
+    """Тестирует полный цикл через CLI без демона."""
+    source_dir = tmp_path / "source"
+    target_dir = tmp_path / "target"
+    patch_file = tmp_path / "update.patch"
+    state_file = tmp_path / "state1.json"
+
+    write_file(source_dir / "file1.txt", "v1")
+    write_file(source_dir / "remove.txt", "remove")
+    shutil.copytree(source_dir, target_dir)
+
+    code, out = run_cli(capsys, "state", source_dir)
+    assert code == 0
+    state_file.write_text(out)
+    assert json.loads(out) == GetState(str(source_dir))
+
+    write_file(source_dir / "file1.txt", "v2")
+    os.remove(source_dir / "remove.txt")
+    write_file(source_dir / "sub" / "new.txt", "new")
+    state2_hash = GetStateHash(GetState(str(source_dir)))
+
+    code, out = run_cli(capsys, "diff", state_file, source_dir)
+    assert code == 0
+    diff = json.loads(out)
+    assert diff['changed'] == ["file1.txt"] and diff['removed'] == ["remove.txt"]
+
+    code, out = run_cli(capsys, "create", state_file, source_dir, patch_file)
+    assert code == 0 and patch_file.exists()
+    assert json.loads(out)['target_state'] == state2_hash
+
+    code, _ = run_cli(capsys, "verify", target_dir, "--patch", patch_file)
+    assert code == 0
+    code, _ = run_cli(capsys, "verify", target_dir, "--hash", state2_hash)
+    assert code == 1
+
+    code, _ = run_cli(capsys, "apply", target_dir, patch_file)
+    assert code == 0
+    code, out = run_cli(capsys, "state", target_dir, "--hash")
+    assert out.strip() == state2_hash
+
+def test_cli_errors(tmp_path, capsys):
+    """Тестирует коды возврата CLI при ошибках."""
+    assert main(["state", str(tmp_path / "missing")]) == 1
+    assert "Error:" in capsys.readouterr().err
+    assert main(["verify", str(tmp_path)]) == 2
+
+def test_daemon_reuses_hashes(tmp_path, capsys, daemon_socket, monkeypatch):
+    """Тестирует, что демон выполняет команды и не пересчитывает хэши неизмененных файлов."""
+    socket_path, workspace = daemon_socket
+    folder = tmp_path / "folder"
+    write_file(folder / "a.txt", "a")
+    write_file(folder / "b.txt", "b")
+
+    code, out = run_cli(capsys, "--socket", socket_path, "state", folder, "--hash")
+    assert code == 0
+    assert out.strip() == GetStateHash(GetState(str(folder)))
+    assert len(workspace.hashes) == 2
+
+    # Повторный запрос: хэши берутся из кэша, а измененный файл пересчитывается
+    hashed = []
+    import stateman.daemon
+    real_get_hash = stateman.daemon.get_hash
+    monkeypatch.setattr(stateman.daemon, "get_hash", lambda f: hashed.append(f) or real_get_hash(f))
+    write_file(folder / "b.txt", "b changed")
+    os.utime(folder / "b.txt", ns=(0, 0))
+    result, _ = Request(socket_path, "state", folder=str(folder))
+    assert result == GetState(str(folder))
+    assert hashed == [str(folder / "b.txt")]
+
+    with pytest.raises(DaemonError, match="FileNotFoundError"):
+        Request(socket_path, "state", folder=str(tmp_path / "missing"))
+    code, _ = run_cli(capsys, "--socket", socket_path, "verify", folder, "--hash", "0" * 32)
+    assert code == 1
+
+def test_daemon_keeps_regular_file_at_socket_path(tmp_path, capsys):
+    """Тестирует, что демон не удаляет обычный файл по пути сокета."""
+    if not hasattr(socket, "AF_UNIX"):
+        pytest.skip("Unix sockets are not supported")
+    keep_file = tmp_path / "keep.json"
+    write_file(keep_file, "important")
+
+    with pytest.raises(OSError, match="is not a socket"):
+        Serve(str(keep_file))
+    assert main(["--socket", str(keep_file), "daemon"]) == 1
+    captured = capsys.readouterr()
+    assert "is not a socket" in captured.err
+    assert "listening" not in captured.out
+    assert keep_file.read_text() == "important"
+
+def test_daemon_stop_without_daemon(tmp_path, capsys):
+    """Тестирует остановку демона, когда он не запущен."""
+    assert main(["--socket", str(tmp_path / "missing.sock"), "daemon", "--stop"]) == 1
+    assert "Error:" in capsys.readouterr().err
+
+def test_hash_cache_pruned(tmp_path):
+    """Тестирует, что кэш хэшей не растет из-за удаленных файлов и ограничен по размеру."""
+    folder = tmp_path / "folder"
+    write_file(folder / "a.txt", "a")
+    write_file(folder / "b.txt", "b")
+    workspace = Workspace()
+
+    workspace.get_state(str(folder))
+    assert len(workspace.hashes) == 2
+    os.remove(folder / "b.txt")
+    workspace.get_state(str(folder))
+    assert len(workspace.hashes) == 1
+
+    workspace.hashes.max_entries = 2
+    write_file(folder / "c.txt", "c")
+    write_file(folder / "d.txt", "d")
+    workspace.get_state(str(folder))
+    assert len(workspace.hashes) == 2
+
+def test_daemon_not_blocked_by_stalled_client(tmp_path, daemon_socket):
+    """Тестирует, что зависший клиент не блокирует другие запросы к демону."""
+    socket_path, _ = daemon_socket
+    write_file(tmp_path / "folder" / "a.txt", "a")
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stalled:
+        stalled.connect(socket_path) # Подключается и ничего не отправляет
+        result, _ = Request(socket_path, "ping", timeout=2)
+        assert result['pid'] == os.getpid()
+        result, _ = Request(socket_path, "state", timeout=2, folder=str(tmp_path / "folder"))
+        assert list(result) == ["a.txt"]
+
+def test_request_timeout(tmp_path, monkeypatch):
+    """Тестирует, что клиент не ждет ответа от зависшего демона бесконечно."""
+    if not hasattr(socket, "AF_UNIX"):
+        pytest.skip("Unix sockets are not supported")
+    socket_path = str(tmp_path / "hung.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as hung:
+        hung.bind(socket_path)
+        hung.listen(1) # Принимает подключения, но никогда не отвечает
+        with pytest.raises(TimeoutError):
+            Request(socket_path, "ping", timeout=0.2)
+        import stateman.daemon
+        monkeypatch.setattr(stateman.daemon, "PING_TIMEOUT", 0.2)
+        with pytest.raises(OSError, match="does not respond"):
+            Serve(socket_path)
+        assert os.path.exists(socket_path)
+
+def test_patch_cache_bounded(tmp_path, capsys):
+    """Тестирует, что кэш метаданных патчей ограничен по размеру."""
+    folder = tmp_path / "folder"
+    write_file(folder / "a.txt", "a")
+    workspace = Workspace(max_patches=2)
+    for i in range(3):
+        patch_file = tmp_path / f"{i}.patch"
+        workspace.cmd_create(str(folder), str(folder), str(patch_file))
+        assert workspace.cmd_verify(str(folder), patch_file=str(patch_file))['ok']
+    assert list(workspace._patches) == [str(tmp_path / "1.patch"), str(tmp_path / "2.patch")]
+
+def test_hash_cache_prune_by_folder(tmp_path):
+    """Тестирует, что очистка кэша затрагивает только сканируемую папку и удаленные поддиректории."""
+    folder = tmp_path / "folder"
+    other = tmp_path / "other"
+    write_file(folder / "a.txt", "a")
+    write_file(folder / "sub" / "deep" / "b.txt", "b")
+    write_file(other / "c.txt", "c")
+    workspace = Workspace()
+    workspace.get_state(str(folder))
+    workspace.get_state(str(other))
+    assert len(workspace.hashes) == 3
+
+    shutil.rmtree(folder / "sub")
+    workspace.get_state(str(folder))
+    assert len(workspace.hashes) == 2
+    assert str(folder / "sub") not in workspace.hashes._files
+    assert str(folder / "sub") not in workspace.hashes._subdirs[str(folder)]
+
+    workspace.hashes.clear()
+    workspace.get_state(str(other))
+    assert len(workspace.hashes) == 1
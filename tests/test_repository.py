@@ -0,0 +1,136 @@
+import pytest
+from stateman import GetState, GetStateHash, ApplyPatch
+from stateman.repository import SnapshotRepository, PackManifest, UnpackManifest
+import os
+import shutil
+from zipfile import ZipFile
+
+# --- Helper Functions ---
+
+def write_file(filepath, text):
+    """Вспомогательная функция для создания файла с текстом."""
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    with open(filepath, 'w') as f:
+        f.write(text)
+
+def make_versions(tmp_path):
+    """Создает три версии папки в репозитории и возвращает их хэши."""
+    work_dir = tmp_path / "work"
+    repo = SnapshotRepository(str(tmp_path / "repo"))
+    hashes = []
+
+    write_file(work_dir / "keep.txt", "keep")
+    write_file(work_dir / "change.txt", "v1")
+    write_file(work_dir / "remove.txt", "remove")
+    hashes.append(repo.AddSnapshot(str(work_dir)))
+
+    write_file(work_dir / "change.txt", "v2")
+    os.remove(work_dir / "remove.txt")
+    write_file(work_dir / "sub" / "added.txt", "added")
+    hashes.append(repo.AddSnapshot(str(work_dir)))
+
+    write_file(work_dir / "change.txt", "v3")
+    hashes.append(repo.AddSnapshot(str(work_dir)))
+    return repo, work_dir, hashes
+
+# --- Test Cases ---
+
+def test_manifest_roundtrip(tmp_path):
+    """Тестирует упаковку и распаковку бинарного манифеста."""
+    write_file(tmp_path / "a.txt", "a")
+    write_file(tmp_path / "dir" / "b.txt", "b")
+    state = GetState(str(tmp_path))
+
+    data = PackManifest(state)
+    assert UnpackManifest(data) == state
+    assert PackManifest(dict(reversed(list(state.items())))) == data
+
+    with pytest.raises(ValueError):
+        UnpackManifest(b"garbage")
+
+def test_add_snapshot_dedup(tmp_path):
+    """Тестирует, что снапшоты хранятся по GetStateHash, а содержимое файлов не дублируется."""
+    repo, work_dir, hashes = make_versions(tmp_path)
+
+    assert len(set(hashes)) == 3
+    assert repo.ListSnapshots() == sorted(hashes)
+    assert GetStateHash(repo.GetSnapshot(hashes[-1])) == hashes[-1]
+    assert repo.GetSnapshot(hashes[-1]) == GetState(str(work_dir))
+    assert repo.AddSnapshot(str(work_dir)) == hashes[-1]
+
+    # keep, remove, added + три версии change.txt
+    blobs = [f for _, _, files in os.walk(repo.objects_dir) for f in files]
+    assert len(blobs) == 6
+
+    with pytest.raises(KeyError):
+        repo.GetSnapshot("0" * 32)
+
+def test_get_patch_any_pair(tmp_path):
+    """Тестирует применение патча между любыми двумя сохраненными версиями."""
+    repo, work_dir, hashes = make_versions(tmp_path)
+    final_state = GetState(str(work_dir))
+
+    # Восстанавливаем первую версию из хранилища
+    target_dir = tmp_path / "target"
+    for path, file_hash in repo.GetSnapshot(hashes[0]).items():
+        (target_dir / path).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(repo.GetBlobPath(file_hash), target_dir / path)
+    assert GetStateHash(GetState(str(target_dir))) == hashes[0]
+
+    ApplyPatch(str(target_dir), repo.GetPatch(hashes[0], hashes[2]))
+    assert GetState(str(target_dir)) == final_state
+
+def test_get_patch_cached(tmp_path):
+    """Тестирует, что повторный запрос патча берется из кэша."""
+    repo, _, hashes = make_versions(tmp_path)
+
+    patch_path = repo.GetPatch(hashes[0], hashes[1])
+    mtime = os.stat(patch_path).st_mtime_ns
+    os.remove(repo.GetBlobPath(repo.GetSnapshot(hashes[1])["change.txt"]))
+
+    # Патч не пересобирается (иначе потребовался бы удаленный blob)
+    assert repo.GetPatch(hashes[0], hashes[1]) == patch_path
+    assert os.stat(patch_path).st_mtime_ns >= mtime
+    with ZipFile(patch_path) as z:
+        assert z.read("change.txt") == b"v2"
+
+    # Индекс кэша восстанавливается из папки после перезапуска
+    reopened = SnapshotRepository(repo.root)
+    assert reopened.CachedPatches() == [(hashes[0], hashes[1])]
+
+def test_get_patch_cache_eviction(tmp_path):
+    """Тестирует вытеснение патчей из кэша в порядке LRU."""
+    repo, _, hashes = make_versions(tmp_path)
+    repo.max_cache_entries = 2
+
+    first = repo.GetPatch(hashes[0], hashes[1])
+    repo.GetPatch(hashes[1], hashes[2])
+    repo.GetPatch(hashes[0], hashes[1]) # first становится самым свежим
+    repo.GetPatch(hashes[0], hashes[2])
+
+    assert repo.CachedPatches() == [(hashes[0], hashes[1]), (hashes[0], hashes[2])]
+    assert os.path.isfile(first)
+    assert not os.path.exists(os.path.join(repo.patches_dir, f"{hashes[1]}_{hashes[2]}.patch"))
+
+    # Бюджет по размеру: остается только последний запрошенный патч
+    repo.max_cache_bytes = 1
+    last = repo.GetPatch(hashes[1], hashes[2])
+    assert repo.CachedPatches() == [(hashes[1], hashes[2])]
+    assert os.path.isfile(last)
+
+def test_stale_temp_files_ignored(tmp_path):
+    """Тестирует, что временные файлы после сбоя не считаются снапшотами и удаляются."""
+    repo, _, hashes = make_versions(tmp_path)
+    stale = [
+        os.path.join(repo.manifests_dir, "tmpabc.tmp"),
+        os.path.join(repo.patches_dir, "tmpdef.tmp"),
+        os.path.join(repo.objects_dir, "tmpghi.tmp"),
+    ]
+    for path in stale:
+        with open(path, "wb") as f:
+            f.write(b"partial")
+
+    assert repo.ListSnapshots() == sorted(hashes)
+    reopened = SnapshotRepository(repo.root)
+    assert reopened.ListSnapshots() == sorted(hashes)
+    assert not any(os.path.exists(path) for path in stale)